@@ -0,0 +1,89 @@
+"""
+ACRNM 商品表格解析基准
+
+对比旧实现（整页解析 + 每次编译的 cssselect XPath + 逐行构造模型）与预编译 XPath 实现
+
+    python bench/acrnm_parse.py [-n 次数] [--json]
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+root = Path(__file__).parent.parent / "code"
+sys.path[:0] = [str(root), str(root / "api")]
+
+from acrnm import Product, Variant, parse_products  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from lxml import etree  # noqa: E402
+
+FIXTURE = Path(__file__).parent / "fixtures" / "acrnm.html"
+
+
+def legacy(content: bytes) -> str:
+    root: etree._Element = etree.HTML(content.decode("utf-8"))
+    # cssselect 已不是依赖，这里直接使用它为 `.m-product-table__row` 生成的 XPath
+    table: List[etree._Element] = root.xpath("descendant-or-self::*[@class and contains(concat(' ', normalize-space(@class), ' '), ' m-product-table__row ')]")
+    products = []
+    for tr in table:
+        price = tr.xpath("./td[4]/span/text()")
+        if len(price) == 0:
+            continue
+        product = Product(
+            name=tr.xpath("./td[1]/a/span/text()")[0],
+            href=tr.xpath("./td[1]/a/@href")[0],
+            price=price[0],
+            variants=[],
+        )
+        product.href = product.href.removeprefix("/")
+        for var in tr.xpath("./td[3]/div/span"):
+            color = ", ".join(var.xpath("./div/span/text()"))
+            size = ", ".join(var.xpath("./span/text()"))
+            product.variants.append(Variant(color=color, size=size))
+        products.append(product)
+    return json.dumps(jsonable_encoder(products), ensure_ascii=False)
+
+
+def current(content: bytes) -> str:
+    return json.dumps(parse_products(content), ensure_ascii=False)
+
+
+def measure(fn: Callable[[bytes], str], content: bytes, n: int) -> dict:
+    fn(content)
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn(content)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "name": fn.__name__,
+        "n": n,
+        "mean_ms": sum(samples) / n * 1000,
+        "p50_ms": samples[n // 2] * 1000,
+        "min_ms": samples[0] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="输出 JSON")
+    args = parser.parse_args()
+
+    content = FIXTURE.read_bytes()
+    assert json.loads(legacy(content)) == json.loads(current(content)), "解析结果不一致"
+    results = [measure(fn, content, args.n) for fn in (legacy, current)]
+    if args.json:
+        print(json.dumps({"bench": "acrnm_parse", "results": results}))
+        return
+    for r in results:
+        print(f"{r['name']:<8} mean {r['mean_ms']:8.3f} ms  p50 {r['p50_ms']:8.3f} ms  min {r['min_ms']:8.3f} ms")
+    print(f"speedup  {results[0]['mean_ms'] / results[1]['mean_ms']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
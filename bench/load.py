@@ -0,0 +1,168 @@
+"""
+路由压测
+
+启动本地上游替身与应用，按给定并发压测各路由，输出吞吐量与 p50/p99 延迟
+
+    python bench/load.py [-c 并发] [-d 每个路由的持续秒数] [--latency 上游耗时] [--json] [路由 ...]
+
+默认排除 api/avatar，需要压测头像路由时使用 `--exclude '[]'`
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from mock import make_png, upstream_env
+
+ROOT = Path(__file__).parent.parent / "code"
+AUTH = {"Authorization": "Bearer bench"}
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    path: str
+    json: Optional[dict] = None
+    files: Optional[dict] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("live", "GET", "/api/live/21452505"),
+    Scenario("acrnm", "GET", "/api/acrnm"),
+    Scenario("acrnm_appearances", "GET", "/api/acrnm/appearances"),
+    Scenario("acrnm_changes", "GET", "/api/acrnm/changes"),
+    Scenario("acrnm_product", "GET", "/api/acrnm/J1W-GTV_SS25"),
+    Scenario("avatar_qq", "GET", "/api/avatar/mtf/qq/10000"),
+    Scenario("deepseek_pow", "GET", "/api/deepseek/create_pow_challenge", headers=AUTH),
+    Scenario("deepseek_completion", "POST", "/api/deepseek/completion", json={"prompt": "你好"}, headers=AUTH),
+    Scenario("assistant_chat", "POST", "/api/assistant/deepseek_chat", json={"key": "bench", "input": "你好"}),
+    Scenario("file_upload", "POST", "/api/file", files={"file": ("bench.png", make_png(256), "image/png")}),
+    Scenario("favicon", "GET", "/favicon.ico"),
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} 未就绪")
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def run(client: httpx.AsyncClient, scenario: Scenario, concurrency: int, duration: float) -> dict:
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                resp = await client.request(scenario.method, scenario.path, json=scenario.json, files=scenario.files, headers=scenario.headers)
+                await resp.aread()
+                status = str(resp.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "name": scenario.name,
+        "method": scenario.method,
+        "path": scenario.path,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+        "statuses": statuses,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("-d", "--duration", type=float, default=5.0, help="每个路由的持续秒数")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟上游耗时（秒）")
+    parser.add_argument("--exclude", default='["api/avatar"]', help="传给应用的 EXCLUDE 环境变量")
+    parser.add_argument("--json", action="store_true", help="输出 JSON")
+    parser.add_argument("names", nargs="*", help="仅压测指定路由")
+    args = parser.parse_args()
+
+    mock_port, app_port = free_port(), free_port()
+    mock_url, app_url = f"http://127.0.0.1:{mock_port}", f"http://127.0.0.1:{app_port}"
+    tmp = tempfile.TemporaryDirectory()
+    env = {
+        **os.environ,
+        **upstream_env(mock_url),
+        "EXCLUDE": args.exclude,
+        "PORT": str(app_port),
+        "ACRNM_INDEX": str(Path(tmp.name) / "index.json"),
+        "ACRNM_INTERVAL": "0",
+    }
+    bench = Path(__file__).parent
+    procs = [
+        subprocess.Popen([sys.executable, str(bench / "mock.py"), "--port", str(mock_port), "--latency", str(args.latency)]),
+        subprocess.Popen([sys.executable, "index.py"], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL),
+    ]
+    try:
+        await wait_ready(f"{mock_url}/g")
+        await wait_ready(f"{app_url}/openapi.json")
+        results = []
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=60) as client:
+            for scenario in SCENARIOS:
+                if args.names and scenario.name not in args.names:
+                    continue
+                results.append(await run(client, scenario, args.concurrency, args.duration))
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
+        tmp.cleanup()
+
+    if args.json:
+        print(json.dumps({"bench": "load", "concurrency": args.concurrency, "duration": args.duration, "results": results}))
+        return
+    for r in results:
+        statuses = ",".join(f"{k}:{v}" for k, v in sorted(r["statuses"].items()))
+        print(f"{r['name']:<20} {r['rps']:9.1f} req/s  p50 {r['p50_ms']:9.2f} ms  p99 {r['p99_ms']:9.2f} ms  [{statuses}]")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+"""
+热点函数微基准
+
+    python bench/micro.py [-n 次数] [--json]
+
+依赖缺失的项目（例如未安装 rembg 或 Wand 时的 count_transparent_pixels）会被跳过
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+root = Path(__file__).parent.parent / "code"
+sys.path[:0] = [str(root), str(root / "api"), str(root / "api" / "avatar"), str(Path(__file__).parent)]
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def measure(name: str, fn: Callable[[], object], n: int) -> dict:
+    fn()
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "name": name,
+        "n": n,
+        "mean_ms": sum(samples) / n * 1000,
+        "p50_ms": samples[n // 2] * 1000,
+        "p99_ms": samples[min(n - 1, int(n * 0.99))] * 1000,
+        "min_ms": samples[0] * 1000,
+    }
+
+
+def bench_room_info() -> Callable[[], object]:
+    from live import RoomInfoResponse
+
+    text = (FIXTURES / "room_info.json").read_text(encoding="utf-8")
+    return lambda: RoomInfoResponse.model_validate_json(text)
+
+
+def bench_acrnm_parse() -> Callable[[], object]:
+    from acrnm_parse import FIXTURE, current
+
+    content = FIXTURE.read_bytes()
+    return lambda: current(content)
+
+
+def bench_compute_pow_answer() -> Callable[[], object]:
+    from deepseek import compute_pow_answer
+    from mock import CHALLENGE
+
+    c = CHALLENGE
+    return lambda: asyncio.run(compute_pow_answer(c["challenge"], c["salt"], c["difficulty"], c["expire_at"]))
+
+
+def bench_count_transparent_pixels() -> Callable[[], object]:
+    from mock import make_png
+    from mtf import count_transparent_pixels
+    from wand.image import Image
+
+    image = Image(blob=make_png(512), format="png")
+    return lambda: count_transparent_pixels(image)
+
+
+BENCHES: Dict[str, Callable[[], Callable[[], object]]] = {
+    "RoomInfoResponse": bench_room_info,
+    "acrnm_parse": bench_acrnm_parse,
+    "compute_pow_answer": bench_compute_pow_answer,
+    "count_transparent_pixels": bench_count_transparent_pixels,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="输出 JSON")
+    parser.add_argument("names", nargs="*", help=f"仅运行指定项目，可选 {', '.join(BENCHES)}")
+    args = parser.parse_args()
+
+    results: List[dict] = []
+    skipped: Dict[str, str] = {}
+    for name, setup in BENCHES.items():
+        if args.names and name not in args.names:
+            continue
+        try:
+            fn = setup()
+        except ImportError as e:
+            skipped[name] = f"{type(e).__name__}: {e}"
+            continue
+        results.append(measure(name, fn, args.n))
+
+    if args.json:
+        print(json.dumps({"bench": "micro", "results": results, "skipped": skipped}, ensure_ascii=False))
+        return
+    for r in results:
+        print(f"{r['name']:<26} mean {r['mean_ms']:9.3f} ms  p50 {r['p50_ms']:9.3f} ms  p99 {r['p99_ms']:9.3f} ms")
+    for name, reason in skipped.items():
+        print(f"{name:<26} skipped ({reason})")
+
+
+if __name__ == "__main__":
+    main()
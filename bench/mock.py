@@ -0,0 +1,205 @@
+"""
+本地上游替身
+
+在同一端口上模拟 Bilibili、ACRNM、QQ 头像、DeepSeek 网页版与 OpenAI 兼容接口，供压测使用
+
+    python bench/mock.py [--port 9100] [--latency 0.05]
+
+对应的环境变量：
+
+    BILIBILI_LIVE_API=http://127.0.0.1:9100
+    ACRNM_URL=http://127.0.0.1:9100/acrnm
+    QQ_AVATAR=http://127.0.0.1:9100
+    DEEPSEEK_WEB=http://127.0.0.1:9100
+    DEEPSEEK_API=http://127.0.0.1:9100
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import struct
+import sys
+import time
+import zlib
+from pathlib import Path
+from typing import Dict
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+FIXTURES = Path(__file__).parent / "fixtures"
+ROOM_INFO = json.loads((FIXTURES / "room_info.json").read_text(encoding="utf-8"))
+ACRNM_INDEX = (FIXTURES / "acrnm.html").read_bytes()
+ACRNM_PRODUCT = (FIXTURES / "product.html").read_bytes()
+
+# 模拟上游耗时（秒）
+latency = 0.0
+
+
+def upstream_env(base: str) -> Dict[str, str]:
+    """
+    获取将应用指向替身所需的环境变量
+
+    Args:
+        base (str): 替身地址，例如 `http://127.0.0.1:9100`
+
+    Returns:
+        环境变量
+    """
+    return {
+        "BILIBILI_LIVE_API": base,
+        "ACRNM_URL": f"{base}/acrnm",
+        "QQ_AVATAR": base,
+        "DEEPSEEK_WEB": base,
+        "DEEPSEEK_API": base,
+    }
+
+
+def make_png(size: int = 128) -> bytes:
+    """
+    生成一张中间为圆形的 RGBA 图片
+    """
+    rows = []
+    r = size / 2
+    for y in range(size):
+        row = bytearray(b"\x00")
+        for x in range(size):
+            inside = (x - r) ** 2 + (y - r) ** 2 <= (r * 0.8) ** 2
+            row += bytes((240, 180, 200, 255)) if inside else bytes((255, 255, 255, 255))
+        rows.append(bytes(row))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 6, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"".join(rows))) + chunk(b"IEND", b"")
+
+
+AVATAR = make_png()
+
+
+def make_challenge() -> dict:
+    """
+    使用应用自带的 WASM 生成可解的 PoW 挑战
+    """
+    root = Path(__file__).parent.parent / "code"
+    sys.path[:0] = [str(root), str(root / "api")]
+    import deepseek
+
+    deepseek.load_wasm()
+    salt, expire_at, answer = "bench", int(time.time()) + 86400, random.randint(1000, 50000)
+    retptr = deepseek.add_to_stack(deepseek.store, -16)
+    ptr, length = deepseek.encode_string(f"{salt}_{expire_at}_{answer}")
+    deepseek.exports["wasm_deepseek_hash_v1"](deepseek.store, retptr, ptr, length)
+    ptr, length = struct.unpack("<ii", deepseek.read_memory(retptr, 8))
+    deepseek.add_to_stack(deepseek.store, 16)
+    return {
+        "algorithm": "DeepSeekHashV1",
+        "challenge": deepseek.read_memory(ptr, length).decode("utf-8"),
+        "salt": salt,
+        "signature": "bench",
+        "difficulty": 144000,
+        "expire_at": expire_at,
+        "expire_after": 300000,
+        "target_path": "/api/v0/chat/completion",
+    }
+
+
+CHALLENGE = make_challenge()
+
+
+async def delay():
+    if latency > 0:
+        await asyncio.sleep(latency)
+
+
+async def room_info(request: Request):
+    await delay()
+    return JSONResponse(ROOM_INFO)
+
+
+async def acrnm_index(request: Request):
+    await delay()
+    return HTMLResponse(ACRNM_INDEX)
+
+
+async def acrnm_product(request: Request):
+    await delay()
+    return HTMLResponse(ACRNM_PRODUCT)
+
+
+async def qq_avatar(request: Request):
+    await delay()
+    return Response(AVATAR, media_type="image/png")
+
+
+async def create_pow_challenge(request: Request):
+    await delay()
+    return JSONResponse({"code": 0, "msg": "", "data": {"biz_code": 0, "biz_msg": "", "biz_data": {"challenge": CHALLENGE}}})
+
+
+async def create_chat_session(request: Request):
+    await delay()
+    return JSONResponse({"code": 0, "msg": "", "data": {"biz_code": 0, "biz_msg": "", "biz_data": {"id": "bench-session"}}})
+
+
+async def web_completion(request: Request):
+    async def events():
+        await delay()
+        yield 'data: {"p": "response/thinking_content", "v": "思考"}\n\n'
+        for _ in range(50):
+            yield 'data: {"v": "中"}\n\n'
+        yield 'data: {"p": "response/thinking_elapsed_secs", "v": 1}\n\n'
+        yield 'data: {"p": "response/content", "v": "回答"}\n\n'
+        for _ in range(200):
+            yield 'data: {"v": "内容"}\n\n'
+        yield 'data: {"p": "response", "v": "FINISHED"}\n\n'
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+async def chat_completions(request: Request):
+    body = await request.json()
+    await delay()
+    return JSONResponse(
+        {
+            "id": "bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "bench"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "你好" * 100}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 100, "total_tokens": 110},
+        }
+    )
+
+
+app = Starlette(
+    routes=[
+        Route("/room/v1/Room/get_info", room_info),
+        Route("/acrnm", acrnm_index),
+        Route("/acrnm/{href}", acrnm_product),
+        Route("/g", qq_avatar),
+        Route("/api/v0/chat/create_pow_challenge", create_pow_challenge, methods=["POST"]),
+        Route("/api/v0/chat_session/create", create_chat_session, methods=["POST"]),
+        Route("/api/v0/chat/completion", web_completion, methods=["POST"]),
+        Route("/chat/completions", chat_completions, methods=["POST"]),
+    ]
+)
+
+
+def main():
+    global latency
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟上游耗时（秒）")
+    args = parser.parse_args()
+    latency = args.latency
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,22 @@
-from typing import List, Optional
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path as FilePath
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import cloudscraper
-from fastapi import APIRouter, Path
+import requests
+from fastapi import APIRouter, Path, Query
 from lxml import etree
 from pydantic import BaseModel
 
+from utils import JSONResponse, open_storage, singleflight, span, warmup
+
 
 class Variant(BaseModel):
     """
@@ -26,46 +38,520 @@ class Product(BaseModel):
     variants: Optional[List[Variant]] = None
 
 
-router = APIRouter()
-scraper = cloudscraper.create_scraper()
+class ProductWithImages(Product):
+    """
+    带外观的商品属性
+    """
+
+    images: List[str]
 
 
-@router.get("")
-async def get_acrnm_products() -> List[Product]:
+class PriceChange(BaseModel):
+    """
+    价格变化
+    """
+
+    href: str
+    old: str
+    new: str
+
+
+class VariantChange(BaseModel):
+    """
+    变体变化
+    """
+
+    href: str
+    added: List[Variant]
+    removed: List[Variant]
+
+
+class Changes(BaseModel):
+    """
+    商品列表变化
+    """
+
+    version: str  # 最新版本
+    since: Optional[str] = None  # 起始版本
+    reset: bool  # 起始版本未知，此时 `added` 为完整商品列表
+    added: List[Product]
+    removed: List[Product]
+    price: List[PriceChange]
+    variants: List[VariantChange]
+
+
+class RateLimiter:
+    """
+    限制并发数与请求间隔
     """
-    获取 ACRNM 上架的商品列表
+
+    def __init__(self, concurrency: int, interval: float = 0):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.interval = interval
+        self.lock = asyncio.Lock()
+        self.next = 0.0
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            wait = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
+
+
+class ImageIndex:
+    """
+    商品外观索引
+
+    以 href 为键保存商品指纹与外观链接，条目保存在工作进程共享的存储中，并持久化为 JSON 文件供新实例加载
+    """
+
+    def __init__(self, path: FilePath):
+        self.path = path
+        self.items = open_storage("acrnm.images")
+        self.seeded = False
+
+    def load(self) -> Dict[str, dict]:
+        """
+        读取索引，首次读取时用索引文件补全共享存储中缺少的条目
+
+        Returns:
+            索引
+        """
+        if not self.seeded:
+            self.seeded = True
+            try:
+                for href, item in json.loads(self.path.read_text(encoding="utf-8")).items():
+                    if href not in self.items:
+                        self.items[href] = item
+            except (OSError, ValueError, AttributeError):
+                pass
+        return dict(self.items)
+
+    def save(self, hrefs: Iterable[str]):
+        """
+        移除下架商品并原子地写回索引文件，写入失败时仅保留共享存储中的索引
+
+        Args:
+            hrefs (Iterable[str]): 在售商品
+        """
+        hrefs = set(hrefs)
+        for href in [href for href in self.items if href not in hrefs]:
+            self.items.pop(href, None)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # 多个工作进程可能同时写入，临时文件按进程区分
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(dict(self.items), ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+
+def default_index_path() -> FilePath:
+    """
+    获取外观索引默认路径，优先使用环境变量 `ACRNM_INDEX`，其次为 NAS 挂载目录
+
+    Returns:
+        索引文件路径
+    """
+    if "ACRNM_INDEX" in os.environ:
+        return FilePath(os.environ["ACRNM_INDEX"])
+    nas = FilePath("/mnt/serverless-nana7mi-link")
+    if nas.is_dir():
+        return nas / "acrnm" / "index.json"
+    return FilePath(tempfile.gettempdir()) / "acrnm" / "index.json"
+
+
+def fingerprint(product: dict) -> str:
+    """
+    计算商品指纹，名称、价格或变体变化时指纹随之变化
+
+    Args:
+        product (dict): 商品
+
+    Returns:
+        指纹
+    """
+    return hashlib.sha1(json.dumps(product, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class SnapshotStore:
+    """
+    商品列表快照
+
+    仅在内容变化时记录新版本，版本号为内容指纹，因此不同实例间一致。同一主机上的工作进程通过共享存储互相补全历史版本，
+    并以共享的最新版本指针对齐，避免落后的工作进程返回倒退的变化
+    """
+
+    # 共享存储中最新版本指针与抓取租约的键，版本号均为十六进制，不会与之冲突
+    LATEST = "latest"
+    REFRESHER = "refresher"
+
+    def __init__(self, limit: int = 120):
+        self.limit = limit
+        self.snapshots: "OrderedDict[str, Tuple[float, Dict[str, dict]]]" = OrderedDict()
+        self.shared = open_storage("acrnm.snapshots", ttl=86400)
+
+    @property
+    def latest(self) -> Optional[str]:
+        return next(reversed(self.snapshots), None)
+
+    def record(self, products: List[dict]) -> str:
+        """
+        记录快照
+
+        Args:
+            products (List[dict]): 商品列表
+
+        Returns:
+            版本号
+        """
+        items = {p["href"]: p for p in products}
+        version = hashlib.sha1(json.dumps(items, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        if version != self.latest:
+            now = time.time()
+            self.snapshots.pop(version, None)
+            self.snapshots[version] = (now, items)
+            while len(self.snapshots) > self.limit:
+                self.snapshots.popitem(last=False)
+            self.shared[version] = (now, items)
+            pointer = self.shared.get(self.LATEST)
+            if pointer is None or pointer[0] <= now:
+                self.shared[self.LATEST] = (now, version)
+        return version
+
+    def get(self, version: str) -> Optional[Tuple[float, Dict[str, dict]]]:
+        """
+        获取某版本的记录时间与商品，优先读取共享存储
+
+        Args:
+            version (str): 版本号
+
+        Returns:
+            记录时间与商品，未知时返回空
+        """
+        return self.shared.get(version) or self.snapshots.get(version)
+
+    def current(self) -> Optional[Tuple[str, float, Dict[str, dict]]]:
+        """
+        获取所有工作进程中最新的版本
+
+        Returns:
+            版本号、记录时间与商品，尚无记录时返回空
+        """
+        current = None
+        if self.latest is not None:
+            current = (self.latest, *self.snapshots[self.latest])
+        pointer = self.shared.get(self.LATEST)
+        if pointer is not None and (current is None or pointer[0] > current[1]):
+            snapshot = self.get(pointer[1])
+            if snapshot is not None:
+                current = (pointer[1], pointer[0], snapshot[1])
+        return current
+
+    def diff(self, since: Optional[str]) -> Optional[dict]:
+        """
+        计算自某版本以来的变化
+
+        Args:
+            since (Optional[str]): 起始版本，未知或为空时返回完整列表
+
+        Returns:
+            变化，尚无记录时返回空
+        """
+        current = self.current()
+        if current is None:
+            return None
+        version, recorded, new = current
+        snapshot = self.get(since) if since is not None else None
+        if snapshot is None:
+            return {"version": version, "since": since, "reset": True, "added": list(new.values()), "removed": [], "price": [], "variants": []}
+        if snapshot[0] > recorded:
+            # 起始版本比已知的最新版本还新，不能向旧版本计算变化
+            return {"version": since, "since": since, "reset": False, "added": [], "removed": [], "price": [], "variants": []}
+        old = snapshot[1]
+        changes = {
+            "version": version,
+            "since": since,
+            "reset": False,
+            "added": [p for href, p in new.items() if href not in old],
+            "removed": [p for href, p in old.items() if href not in new],
+            "price": [],
+            "variants": [],
+        }
+        for href in new.keys() & old.keys():
+            a, b = old[href], new[href]
+            if a["price"] != b["price"]:
+                changes["price"].append({"href": href, "old": a["price"], "new": b["price"]})
+            if a["variants"] != b["variants"]:
+                changes["variants"].append(
+                    {
+                        "href": href,
+                        "added": [v for v in b["variants"] if v not in a["variants"]],
+                        "removed": [v for v in a["variants"] if v not in b["variants"]],
+                    }
+                )
+        return changes
+
+
+# 预编译的 XPath，等价于 cssselect 的 `.m-product-table__row`
+ROWS = etree.XPath("descendant-or-self::*[@class and contains(concat(' ', normalize-space(@class), ' '), ' m-product-table__row ')]")
+NAME = etree.XPath("./td[1]/a/span/text()")
+HREF = etree.XPath("./td[1]/a/@href")
+PRICE = etree.XPath("./td[4]/span/text()")
+VARIANTS = etree.XPath("./td[3]/div/span")
+COLOR = etree.XPath("./div/span/text()")
+SIZE = etree.XPath("./span/text()")
+
+
+def product_table(content: bytes) -> bytes:
+    """
+    截取网页中的商品表格，找不到时返回原网页
+
+    Args:
+        content (bytes): 网页源码
+
+    Returns:
+        商品表格源码
+    """
+    idx = content.find(b"m-product-table")
+    if idx == -1:
+        return content
+    start = content.rfind(b"<table", 0, idx)
+    end = content.find(b"</table>", idx)
+    if start == -1 or end == -1:
+        return content
+    return content[start : end + len(b"</table>")]
+
+
+def parse_products(content: bytes, encoding: str = "utf-8") -> List[dict]:
+    """
+    解析商品列表
+
+    只解析商品表格并直接生成字典，不再逐行构造 `Product`
+
+    Args:
+        content (bytes): 网页源码
+        encoding (str, optional): 网页编码，截取表格后 `<meta charset>` 会丢失，因此需要显式指定
 
     Returns:
         商品列表
     """
-    # 获取网页
-    resp = scraper.get("https://acrnm.com?sort=default&filter=txt")
-    root: etree._Element = etree.HTML(resp.text)
-    table: List[etree._Element] = root.cssselect(".m-product-table__row")
-    # 解析数据
+    root: etree._Element = etree.HTML(product_table(content), parser=etree.HTMLParser(encoding=encoding))
+    if root is None:
+        return []
     products = []
-    for tr in table:
-        price = tr.xpath("./td[4]/span/text()")
+    for tr in ROWS(root):
+        price = PRICE(tr)
         if len(price) == 0:
             continue
-        product = Product(
-            name=tr.xpath("./td[1]/a/span/text()")[0],
-            href=tr.xpath("./td[1]/a/@href")[0],
-            price=price[0],
-            variants=[],
+        products.append(
+            {
+                "name": str(NAME(tr)[0]),
+                # 去掉难绷前缀
+                "href": str(HREF(tr)[0]).removeprefix("/"),
+                "price": str(price[0]),
+                "variants": [{"color": ", ".join(COLOR(var)), "size": ", ".join(SIZE(var))} for var in VARIANTS(tr)],
+            }
         )
-        # 去掉难绷前缀
-        product.href = product.href.removeprefix("/")
-        variants: List[etree._Element] = tr.xpath("./td[3]/div/span")
-        for var in variants:
-            color = ", ".join(var.xpath("./div/span/text()"))
-            size = ", ".join(var.xpath("./span/text()"))
-            product.variants.append(Variant(color=color, size=size))
-        products.append(product)
     return products
 
 
+ACRNM_URL = os.environ.get("ACRNM_URL", "https://acrnm.com")
+
+router = APIRouter()
+scraper: Optional[cloudscraper.CloudScraper] = None
+scraper_lock = threading.Lock()
+limiter = RateLimiter(int(os.environ.get("ACRNM_CONCURRENCY", 4)), float(os.environ.get("ACRNM_INTERVAL", 0.2)))
+image_index = ImageIndex(default_index_path())
+snapshots = SnapshotStore(int(os.environ.get("ACRNM_HISTORY", 120)))
+refresher: Optional[asyncio.Task] = None
+
+
+@warmup("acrnm")
+def get_scraper() -> cloudscraper.CloudScraper:
+    """
+    获取 cloudscraper 会话，首次调用时创建
+
+    Returns:
+        会话
+    """
+    global scraper
+    with scraper_lock:
+        if scraper is None:
+            scraper = cloudscraper.create_scraper()
+    return scraper
+
+
+def scrape(url: str) -> requests.Response:
+    """
+    使用 cloudscraper 会话请求网页，会话创建与请求都会阻塞，需在工作线程中调用
+
+    Args:
+        url (str): 网址
+
+    Returns:
+        响应
+    """
+    return get_scraper().get(url)
+
+
+async def refresh_products(interval: float):
+    """
+    定时抓取商品列表以记录快照
+
+    Args:
+        interval (float): 抓取间隔（秒）
+    """
+    owner = str(os.getpid())
+    while True:
+        try:
+            # 同一主机上只有持有租约的工作进程抓取，其余进程通过共享存储读取快照
+            if await asyncio.to_thread(snapshots.shared.lease, SnapshotStore.REFRESHER, owner, interval * 3):
+                await fetch_products()
+        except Exception:
+            pass
+        await asyncio.sleep(interval)
+
+
+@singleflight()
+async def fetch_products() -> List[dict]:
+    """
+    获取并解析 ACRNM 上架的商品列表
+
+    Returns:
+        商品列表
+    """
+    with span("acrnm.fetch"):
+        resp = await asyncio.to_thread(scrape, f"{ACRNM_URL}?sort=default&filter=txt")
+    with span("acrnm.parse"):
+        products = await asyncio.to_thread(parse_products, resp.content, resp.encoding or "utf-8")
+    await asyncio.to_thread(snapshots.record, products)
+    return products
+
+
+@router.get("", response_model=List[Product])
+async def get_acrnm_products():
+    """
+    获取 ACRNM 上架的商品列表
+
+    Returns:
+        商品列表
+    """
+    return JSONResponse(await fetch_products())
+
+
+@router.get("/changes", response_model=Changes)
+async def get_acrnm_changes(since: Optional[str] = Query(None, description="上次获取到的版本号")):
+    """
+    获取 ACRNM 商品列表自某版本以来的变化
+
+    首次调用时启动后台定时抓取，之后直接读取快照
+
+    Args:
+        since (Optional[str], optional): 上次获取到的版本号
+
+    Returns:
+        新增与下架的商品、价格变化与变体变化
+    """
+    global refresher
+    if refresher is None or refresher.done():
+        refresher = asyncio.create_task(refresh_products(float(os.environ.get("ACRNM_REFRESH", 60))))
+    changes = await asyncio.to_thread(snapshots.diff, since)
+    if changes is None:
+        await fetch_products()
+        changes = await asyncio.to_thread(snapshots.diff, since)
+    return JSONResponse(changes)
+
+
+def parse_appearance(text: str) -> List[str]:
+    """
+    解析商品详情页中的外观链接
+
+    Args:
+        text (str): 网页源码
+
+    Returns:
+        外观链接列表
+    """
+    root: etree._Element = etree.HTML(text)
+    return root.xpath("//div[contains(@class, 'product-image')]//img/@src")
+
+
+async def fetch_appearance(href: str) -> List[str]:
+    """
+    获取商品详情页并解析外观
+
+    Args:
+        href (str): 商品实际名称
+
+    Returns:
+        外观链接列表
+    """
+    with span("acrnm.fetch_appearance"):
+        resp = await asyncio.to_thread(scrape, f"{ACRNM_URL}/{href.removeprefix('/')}")
+    with span("acrnm.parse_appearance"):
+        return await asyncio.to_thread(parse_appearance, resp.text)
+
+
+@singleflight()
+async def fetch_appearances(refresh: bool = False) -> List[dict]:
+    """
+    获取 ACRNM 上架的商品列表及其外观
+
+    仅对新增或变化的商品并发抓取详情页，其余直接读取外观索引
+
+    Args:
+        refresh (bool, optional): 忽略索引重新获取全部外观
+
+    Returns:
+        带外观的商品列表
+    """
+    products = await fetch_products()
+    prints = {p["href"]: fingerprint(p) for p in products}
+    items = await asyncio.to_thread(image_index.load)
+    stale = [p["href"] for p in products if refresh or items.get(p["href"], {}).get("hash") != prints[p["href"]]]
+
+    async def update(href: str):
+        async with limiter:
+            try:
+                images = await fetch_appearance(href)
+            except Exception:
+                return
+        items[href] = {"hash": prints[href], "images": images}
+        # 逐条写入共享存储，不会覆盖其他工作进程抓取的条目
+        await asyncio.to_thread(image_index.items.__setitem__, href, items[href])
+
+    if stale:
+        await asyncio.gather(*map(update, stale))
+        # 下架商品移出索引
+        await asyncio.to_thread(image_index.save, prints.keys())
+
+    return [{**p, "images": items.get(p["href"], {}).get("images", [])} for p in products]
+
+
+@router.get("/appearances", response_model=List[ProductWithImages])
+async def get_acrnm_appearances(refresh: bool = Query(False, description="忽略索引重新获取全部外观")):
+    """
+    获取 ACRNM 上架的商品列表及其外观
+
+    Args:
+        refresh (bool, optional): 忽略索引重新获取全部外观
+
+    Returns:
+        带外观的商品列表
+    """
+    return JSONResponse(await fetch_appearances(refresh))
+
+
 @router.get("/{href}")
+@singleflight(key=lambda href: href.removeprefix("/"))
 async def get_product_appearance(href: str = Path(..., description="商品实际名称", example="J1W-GTV_SS25")) -> List[str]:
     """
     获取商品外观
@@ -76,6 +562,4 @@ async def get_product_appearance(href: str = Path(..., description="商品实际
     Returns:
         外观链接列表
     """
-    resp = scraper.get(f"https://acrnm.com/{href}")
-    root: etree._Element = etree.HTML(resp.text)
-    return root.xpath("//div[contains(@class, 'product-image')]//img/@src")
+    return await fetch_appearance(href)
@@ -1,3 +1,4 @@
+import os
 from typing import List, Optional
 
 from fastapi import APIRouter
@@ -19,6 +20,8 @@ class Session(BaseSession):
     model: str
 
 
+DEEPSEEK_API = os.environ.get("DEEPSEEK_API", "https://api.deepseek.com")
+
 router = APIRouter()
 
 
@@ -66,7 +69,7 @@ async def deepseek_chat(session: BaseSession):
             input=session.input,
             system=session.system,
             history=session.history,
-            url="https://api.deepseek.com",
+            url=DEEPSEEK_API,
             model="deepseek-chat",
         )
     )
@@ -89,7 +92,7 @@ async def deepseek_reasoner(session: BaseSession):
             input=session.input,
             system=session.system,
             history=session.history,
-            url="https://api.deepseek.com",
+            url=DEEPSEEK_API,
             model="deepseek-reasoner",
         )
     )
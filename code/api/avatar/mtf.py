@@ -1,17 +1,121 @@
+import asyncio
+import hashlib
 import html
+import os
+import platform
+import threading
 from io import BytesIO
+from typing import Dict
 
 import httpx
+import onnxruntime as ort
 import rembg
 from fastapi import APIRouter, Query
 from fastapi.responses import StreamingResponse
+from onnxruntime.capi.onnxruntime_pybind11_state import Fail, InvalidGraph, InvalidProtobuf, NoSuchFile
+from rembg.sessions import sessions_class
+from rembg.sessions.base import BaseSession
 from wand.color import Color
 from wand.drawing import Drawing
 from wand.image import Image
 
+from utils import cache_dir, singleflight, span, warmup
+
 # models: https://github.com/danielgatis/rembg/releases/tag/v0.0.0
-u2net = rembg.new_session("u2net")
-isnet_anime = rembg.new_session("isnet-anime")
+sessions: Dict[str, BaseSession] = {}
+sessions_lock = threading.Lock()
+
+
+def session_options() -> ort.SessionOptions:
+    """
+    创建 onnxruntime 会话选项，与 `rembg.new_session` 一样遵循环境变量 `OMP_NUM_THREADS`
+
+    Returns:
+        会话选项
+    """
+    opts = ort.SessionOptions()
+    if "OMP_NUM_THREADS" in os.environ:
+        opts.inter_op_num_threads = opts.intra_op_num_threads = int(os.environ["OMP_NUM_THREADS"])
+    return opts
+
+
+def hardware() -> str:
+    """
+    获取影响图优化结果的硬件标识，NAS 上的缓存由不同实例共享，优化后的模型只能在相同的设备与指令集上使用
+
+    Returns:
+        执行设备、架构与 CPU 指令集摘要
+    """
+    flags = ""
+    try:
+        with open("/proc/cpuinfo") as fp:
+            flags = next((line for line in fp if line.startswith(("flags", "Features"))), "")
+    except OSError:
+        pass
+    return f"{ort.get_device().lower()}-{platform.machine()}-{hashlib.sha1(flags.encode('utf-8')).hexdigest()[:8]}"
+
+
+def new_session(model_name: str) -> BaseSession:
+    """
+    创建 rembg 会话
+
+    缓存目录可用时，首次创建会保存 onnxruntime 优化后的模型，之后直接加载优化后的模型以跳过图优化
+
+    Args:
+        model_name (str): 模型名
+
+    Returns:
+        会话
+    """
+    cache = cache_dir()
+    base = next((c for c in sessions_class if c.name() == model_name), None)
+    if cache is None or base is None:
+        return rembg.new_session(model_name)
+    optimized = cache / f"{model_name}.ort-{ort.__version__}-{hardware()}.onnx"
+    if optimized.is_file():
+        # 让会话从缓存目录读取模型，模型已经优化过，不再重复图优化
+        session_class = type(base.__name__, (base,), {"download_models": classmethod(lambda cls, *args, **kwargs: str(optimized))})
+        opts = session_options()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        try:
+            return session_class(model_name, opts)
+        except (Fail, InvalidGraph, InvalidProtobuf, NoSuchFile):
+            # 缓存损坏或与当前 onnxruntime 不兼容，重新生成
+            optimized.unlink(missing_ok=True)
+    opts = session_options()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    # 先写入临时文件再替换，避免其他进程读到不完整的模型
+    temp = optimized.with_name(f"{optimized.name}.{os.getpid()}.tmp")
+    opts.optimized_model_filepath = str(temp)
+    session = base(model_name, opts)
+    try:
+        os.replace(temp, optimized)
+    except OSError:
+        temp.unlink(missing_ok=True)
+    return session
+
+
+def get_session(model_name: str) -> BaseSession:
+    """
+    获取 rembg 会话，首次调用时创建
+
+    Args:
+        model_name (str): 模型名
+
+    Returns:
+        会话
+    """
+    with sessions_lock:
+        if model_name not in sessions:
+            sessions[model_name] = new_session(model_name)
+        return sessions[model_name]
+
+
+# onnxruntime 的线程池不能跨 fork，只在工作进程中加载
+@warmup("avatar", preload=False)
+def load_sessions():
+    get_session("isnet-anime")
+    get_session("u2net")
 
 
 def count_transparent_pixels(image: Image, limit: int = 25):
@@ -47,13 +151,17 @@ def get_removed_image(origin: bytes) -> Image:
     Returns:
         图片
     """
-    b = rembg.remove(origin, session=isnet_anime)
+    with span("avatar.rembg"):
+        b = rembg.remove(origin, session=get_session("isnet-anime"))
     rem = Image(blob=b, format="png")
     rem.alpha_channel = True
-    if count_transparent_pixels(rem) <= 0.8:
+    with span("avatar.count_transparent_pixels"):
+        ratio = count_transparent_pixels(rem)
+    if ratio <= 0.8:
         return rem
     # 空白比例过高则更换模型重试
-    b = rembg.remove(origin, session=u2net)
+    with span("avatar.rembg"):
+        b = rembg.remove(origin, session=get_session("u2net"))
     rem = Image(blob=b, format="png")
     rem.alpha_channel = True
     return rem
@@ -103,6 +211,8 @@ def set_mtf_background(img: Image, radius: float = 0):
     return flag
 
 
+QQ_AVATAR = os.environ.get("QQ_AVATAR", "https://q1.qlogo.cn")
+
 router = APIRouter()
 
 
@@ -120,7 +230,35 @@ async def get_qq_mtf_avatar(qq: int, radius: float = Query(0.0), scale: float =
     Returns:
         图片的数据流
     """
-    return await get_mtf_avatar(f"https://q1.qlogo.cn/g?b=qq&nk={qq}&s=5", radius, scale, format)
+    return await get_mtf_avatar(f"{QQ_AVATAR}/g?b=qq&nk={qq}&s=5", radius, scale, format)
+
+
+@singleflight()
+async def render_mtf_avatar(url: str, radius: float = 0.0, scale: float = 1.0) -> bytes:
+    """
+    渲染 mtf 风格化头像
+
+    Args:
+        url (str): 已反转义的原图片链接
+        radius (float, optional): 高斯模糊
+        scale (float, optional): 缩放倍数
+
+    Returns:
+        PNG 图片字节
+    """
+    with span("avatar.fetch"):
+        async with httpx.AsyncClient() as session:
+            resp = await session.get(url, timeout=30)
+
+    def render() -> bytes:
+        img = get_removed_image(resp.content)
+        with span("avatar.composite"):
+            if scale != 1.0:
+                img.resize(int(scale * img.width), int(scale * img.height))
+            avatar = set_mtf_background(img, radius)
+            return avatar.make_blob("png")
+
+    return await asyncio.to_thread(render)
 
 
 @router.get("")
@@ -137,11 +275,6 @@ async def get_mtf_avatar(url: str = Query(...), radius: float = Query(0.0), scal
     Returns:
         图片的数据流
     """
-    async with httpx.AsyncClient() as session:
-        resp = await session.get(html.unescape(url), timeout=30)
-    img = get_removed_image(resp.content)
-    if scale != 1.0:
-        img.resize(int(scale * img.width), int(scale * img.height))
-    avatar = set_mtf_background(img, radius)
-    img_io = BytesIO(avatar.make_blob("png"))
+    blob = await render_mtf_avatar(html.unescape(url), float(radius), float(scale))
+    img_io = BytesIO(blob)
     return StreamingResponse(img_io, media_type=f"image/{format}", headers={"Cache-Control": "max-age=86400"})
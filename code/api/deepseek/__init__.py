@@ -1,22 +1,81 @@
+import asyncio
 import base64
 import ctypes
+import hashlib
 import json
+import os
 import struct
+import threading
+from importlib.metadata import version
 from pathlib import Path
 
 import httpx
 import sseclient
 from fastapi import APIRouter, Header
 from pydantic import BaseModel
-from wasmtime import Linker, Module, Store
+from wasmtime import Engine, Linker, Module, Store
 
-store = Store()
-module = Module.from_file(store.engine, Path(__file__).parent / "sha3_wasm_bg.7b9ca65ddd.wasm")
-exports = Linker(store.engine).instantiate(store, module).exports(store)
-memory = exports["memory"]
-wasm_solve = exports["wasm_solve"]
-alloc = exports["__wbindgen_export_0"]
-add_to_stack = exports["__wbindgen_add_to_stack_pointer"]
+from utils import cache_dir, span, warmup
+
+WASM = Path(__file__).parent / "sha3_wasm_bg.7b9ca65ddd.wasm"
+
+store = None
+exports = None
+memory = None
+wasm_solve = None
+alloc = None
+add_to_stack = None
+lock = threading.Lock()
+
+
+def compile_module(engine: Engine) -> Module:
+    """
+    编译 WASM 模块，缓存目录可用时读取或写入序列化后的模块
+
+    Args:
+        engine (Engine): 引擎
+
+    Returns:
+        模块
+    """
+    cache = cache_dir()
+    if cache is None:
+        return Module.from_file(engine, WASM)
+    # 序列化结果只能被相同版本的 wasmtime 读取
+    key = hashlib.sha256(WASM.read_bytes()).hexdigest()[:16]
+    path = cache / f"{WASM.stem}.{key}.wasmtime-{version('wasmtime')}.bin"
+    try:
+        return Module.deserialize_file(engine, str(path))
+    except Exception:
+        pass
+    module = Module.from_file(engine, WASM)
+    try:
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(module.serialize())
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    return module
+
+
+@warmup("deepseek")
+def load_wasm():
+    """
+    加载 WASM 模块，重复调用时直接返回
+    """
+    global store, exports, memory, wasm_solve, alloc, add_to_stack
+    with lock:
+        if store is not None:
+            return
+        engine = Engine()
+        module = compile_module(engine)
+        s = Store(engine)
+        exports = Linker(engine).instantiate(s, module).exports(s)
+        memory = exports["memory"]
+        wasm_solve = exports["wasm_solve"]
+        alloc = exports["__wbindgen_export_0"]
+        add_to_stack = exports["__wbindgen_add_to_stack_pointer"]
+        store = s
 
 
 def read_memory(offset: int, size: int) -> bytes:
@@ -33,9 +92,53 @@ def encode_string(text: str):
     return ptr, length
 
 
+DEEPSEEK_WEB = os.environ.get("DEEPSEEK_WEB", "https://chat.deepseek.com")
+
 router = APIRouter()
 
 
+def solve(challenge: str, prefix: str, difficulty: float) -> dict:
+    """
+    调用 WASM 模块求解，会阻塞较长时间，需在工作线程中调用
+
+    WASM 实例不能被多个线程同时使用，求解期间持有 `lock`
+
+    Args:
+        challenge (str): 挑战字符串
+        prefix (str): 前缀
+        difficulty (float): 挑战难度
+
+    Returns:
+        结果
+    """
+    load_wasm()
+    with lock:
+        # 申请 16 字节栈空间
+        retptr = add_to_stack(store, -16)
+        try:
+            # 编码 challenge 与 prefix 到 wasm 内存中
+            ptr_challenge, len_challenge = encode_string(challenge)
+            ptr_prefix, len_prefix = encode_string(prefix)
+            # 调用 wasm_solve
+            with span("deepseek.wasm_solve"):
+                wasm_solve(store, retptr, ptr_challenge, len_challenge, ptr_prefix, len_prefix, difficulty)
+            # 从 retptr 处读取 4 字节状态和 8 字节求解结果
+            status_bytes = read_memory(retptr, 4)
+            if len(status_bytes) != 4:
+                return {"code": 1, "message": "读取状态字节失败"}
+            status = struct.unpack("<i", status_bytes)[0]
+            value_bytes = read_memory(retptr + 8, 8)
+            if len(value_bytes) != 8:
+                return {"code": 2, "message": "读取结果字节失败"}
+            value = struct.unpack("<d", value_bytes)[0]
+        finally:
+            # 恢复栈指针
+            add_to_stack(store, 16)
+    if status == 0:
+        return {"code": 3, "message": "状态为空"}
+    return {"code": 0, "message": "成功", "data": int(value)}
+
+
 @router.get("/compute_pow_answer")
 async def compute_pow_answer(challenge: str, salt: str, difficulty: int, expire_at: int) -> dict:
     """
@@ -50,29 +153,7 @@ async def compute_pow_answer(challenge: str, salt: str, difficulty: int, expire_
     Returns:
         结果
     """
-    # 申请 16 字节栈空间
-    retptr = add_to_stack(store, -16)
-    # 编码 challenge 与 prefix 到 wasm 内存中
-    ptr_challenge, len_challenge = encode_string(challenge)
-    ptr_prefix, len_prefix = encode_string(f"{salt}_{expire_at}_")
-    # 调用 wasm_solve
-    wasm_solve(store, retptr, ptr_challenge, len_challenge, ptr_prefix, len_prefix, float(difficulty))
-    # 从 retptr 处读取 4 字节状态和 8 字节求解结果
-    status_bytes = read_memory(retptr, 4)
-    if len(status_bytes) != 4:
-        add_to_stack(store, 16)
-        return {"code": 1, "message": "读取状态字节失败"}
-    status = struct.unpack("<i", status_bytes)[0]
-    value_bytes = read_memory(retptr + 8, 8)
-    if len(value_bytes) != 8:
-        add_to_stack(store, 16)
-        return {"code": 2, "message": "读取结果字节失败"}
-    value = struct.unpack("<d", value_bytes)[0]
-    # 恢复栈指针
-    add_to_stack(store, 16)
-    if status == 0:
-        return {"code": 3, "message": "状态为空"}
-    return {"code": 0, "message": "成功", "data": int(value)}
+    return await asyncio.to_thread(solve, challenge, f"{salt}_{expire_at}_", float(difficulty))
 
 
 @router.get("/create_pow_challenge")
@@ -87,11 +168,12 @@ async def create_pow_challenge(authorization: str = Header(..., alias="Authoriza
         挑战结果
     """
     async with httpx.AsyncClient() as session:
-        r = await session.post(
-            "https://chat.deepseek.com/api/v0/chat/create_pow_challenge",
-            json={"target_path": "/api/v0/chat/completion"},
-            headers={"Authorization": authorization},
-        )
+        with span("deepseek.create_pow_challenge"):
+            r = await session.post(
+                f"{DEEPSEEK_WEB}/api/v0/chat/create_pow_challenge",
+                json={"target_path": "/api/v0/chat/completion"},
+                headers={"Authorization": authorization},
+            )
         data = r.json()
         if data["code"] != 0:
             return data
@@ -134,7 +216,7 @@ async def completion(o: CompletionOptions, authorization: str = Header(..., alia
 
     async with httpx.AsyncClient() as session:
         r = await session.post(
-            "https://chat.deepseek.com/api/v0/chat_session/create",
+            f"{DEEPSEEK_WEB}/api/v0/chat_session/create",
             headers={"Authorization": authorization},
         )
         data = r.json()
@@ -144,7 +226,7 @@ async def completion(o: CompletionOptions, authorization: str = Header(..., alia
     def with_httpx():
         with httpx.stream(
             "POST",
-            "https://chat.deepseek.com/api/v0/chat/completion",
+            f"{DEEPSEEK_WEB}/api/v0/chat/completion",
             json={
                 "chat_session_id": data["data"]["biz_data"]["id"],
                 "parent_message_id": None,
@@ -157,27 +239,32 @@ async def completion(o: CompletionOptions, authorization: str = Header(..., alia
         ) as s:
             yield from s.iter_bytes()
 
-    content = []
-    append_content = False
-    thinking_content = []
-    append_thinking_content = False
-
-    client = sseclient.SSEClient(with_httpx())
-    for event in client.events():
-        data: dict = json.loads(event.data)
-        p: str = data.get("p", "")
-        if p == "response/content":
-            append_content = True
-        elif p == "response":
-            append_content = False
-        elif p == "response/thinking_content":
-            append_thinking_content = True
-        elif p == "response/thinking_elapsed_secs":
-            append_thinking_content = False
-
-        if append_content:
-            content.append(data["v"])
-        elif append_thinking_content:
-            thinking_content.append(data["v"])
-
-    return {"code": 0, "thinking_content": "".join(thinking_content), "content": "".join(content)}
+    def relay():
+        content = []
+        append_content = False
+        thinking_content = []
+        append_thinking_content = False
+
+        client = sseclient.SSEClient(with_httpx())
+        with span("deepseek.relay"):
+            for event in client.events():
+                data: dict = json.loads(event.data)
+                p: str = data.get("p", "")
+                if p == "response/content":
+                    append_content = True
+                elif p == "response":
+                    append_content = False
+                elif p == "response/thinking_content":
+                    append_thinking_content = True
+                elif p == "response/thinking_elapsed_secs":
+                    append_thinking_content = False
+
+                if append_content:
+                    content.append(data["v"])
+                elif append_thinking_content:
+                    thinking_content.append(data["v"])
+        return "".join(thinking_content), "".join(content)
+
+    # 同步读取上游事件流，在工作线程中执行以免阻塞事件循环
+    thinking_content, content = await asyncio.to_thread(relay)
+    return {"code": 0, "thinking_content": thinking_content, "content": content}
@@ -1,3 +1,5 @@
+import asyncio
+import os
 import uuid
 from io import BytesIO
 
@@ -5,7 +7,9 @@ import puremagic
 from fastapi import APIRouter, File, HTTPException, UploadFile
 from fastapi.responses import StreamingResponse
 
-FILE_STORAGE = {}
+from utils import open_storage
+
+FILE_STORAGE = open_storage("file", ttl=float(os.environ.get("FILE_TTL", 86400)))
 
 router = APIRouter()
 
@@ -25,7 +29,8 @@ async def upload(file: UploadFile = File(...)) -> str:
         file_info["mime"] = result[0][3] if result else "application/octet-stream"
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"推测 MIME 出错: {e}")
-    FILE_STORAGE[file_uuid] = file_info
+    # SQLite 存储会序列化整个文件并可能等待锁，不能在事件循环中执行
+    await asyncio.to_thread(FILE_STORAGE.__setitem__, file_uuid, file_info)
     return file_uuid
 
 
@@ -34,9 +39,9 @@ async def download(file_uuid: str):
     """
     根据 UUID 从内存读取文件，并返回对应具体MIME类型的文件流
     """
-    if file_uuid not in FILE_STORAGE:
+    file_info = await asyncio.to_thread(FILE_STORAGE.get, file_uuid)
+    if file_info is None:
         raise HTTPException(status_code=404, detail="未找到该 UUID 对应的文件")
-    file_info = FILE_STORAGE[file_uuid]
     file_stream = BytesIO(file_info["content"])
     file_stream.seek(0)
     return StreamingResponse(
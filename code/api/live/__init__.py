@@ -1,9 +1,36 @@
-from typing import Any, List
+import asyncio
+import json
+import os
+import struct
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
 import httpx
-from fastapi import APIRouter
+from fastapi import APIRouter, WebSocket
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from utils import singleflight, span
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BILIBILI_LIVE_API = os.environ.get("BILIBILI_LIVE_API", "https://api.live.bilibili.com")
+BILIBILI_BROADCAST = os.environ.get("BILIBILI_BROADCAST", "wss://broadcastlv.chat.bilibili.com/sub")
+HEADERS = {
+    "Referer": "https://www.bilibili.com/",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36 Edg/116.0.1938.54",
+}
+
 router = APIRouter()
 
 
@@ -95,22 +122,22 @@ class RoomInfoResponse(BaseModel):
 
 
 @router.get("/{roomid}")
+@singleflight()
 async def get_room_info(roomid: int):
     """
     获取房间直播状态
     """
     async with httpx.AsyncClient() as session:
         try:
-            resp = await session.get(
-                url="https://api.live.bilibili.com/room/v1/Room/get_info",
-                params={"room_id": roomid},
-                headers={
-                    "Referer": "https://www.bilibili.com/",
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36 Edg/116.0.1938.54",
-                },
-            )
+            with span("live.fetch"):
+                resp = await session.get(
+                    url=f"{BILIBILI_LIVE_API}/room/v1/Room/get_info",
+                    params={"room_id": roomid},
+                    headers=HEADERS,
+                )
             try:
-                r = RoomInfoResponse.model_validate_json(resp.text)
+                with span("live.validate"):
+                    r = RoomInfoResponse.model_validate_json(resp.text)
                 if r.code != 0:
                     return {"code": 3, "message": r.message}
                 if r.data.live_status != 1:
@@ -135,3 +162,261 @@ async def get_room_info(roomid: int):
             if str(e) != "":
                 msg += f": {str(e)}"
             return {"code": 1, "message": msg}
+
+
+class Watcher(ABC):
+    """
+    房间状态监听
+
+    每个房间只保持一个上游连接，开播与下播时向所有订阅者广播 `get_room_info` 的结果
+    """
+
+    def __init__(self, roomid: int):
+        self.roomid = roomid
+        self.status: Optional[dict] = None
+        self.queues: Set[asyncio.Queue] = set()
+        self.task: Optional[asyncio.Task] = None
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        订阅房间状态，已知当前状态时会立即收到一次
+
+        Returns:
+            事件队列
+        """
+        queue = asyncio.Queue(maxsize=16)
+        if self.status is not None:
+            queue.put_nowait(self.status)
+        self.queues.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        """
+        取消订阅，没有订阅者时断开上游连接
+
+        Args:
+            queue (asyncio.Queue): 事件队列
+        """
+        self.queues.discard(queue)
+        if not self.queues:
+            if self.task is not None:
+                self.task.cancel()
+            if watchers.get(self.roomid) is self:
+                del watchers[self.roomid]
+
+    async def refresh(self) -> bool:
+        """
+        获取房间状态，开播状态变化时广播
+
+        Returns:
+            开播状态是否变化
+        """
+        status = await get_room_info(self.roomid)
+        # 获取失败时保持原状态
+        if status["code"] not in (0, 4):
+            return False
+        if self.status is not None and self.status["code"] == status["code"]:
+            return False
+        self.status = status
+        for queue in self.queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(status)
+        return True
+
+    @abstractmethod
+    async def run(self):
+        pass
+
+
+class PollingWatcher(Watcher):
+    """
+    自适应轮询
+
+    状态变化后以最短间隔轮询，状态不变时逐渐放慢到最长间隔
+    """
+
+    minimum = float(os.environ.get("LIVE_POLL_MIN", 5))
+    maximum = float(os.environ.get("LIVE_POLL_MAX", 30))
+
+    async def run(self):
+        interval = self.minimum
+        while True:
+            if await self.refresh():
+                interval = self.minimum
+            else:
+                interval = min(interval * 1.5, self.maximum)
+            await asyncio.sleep(interval)
+
+
+# 弹幕协议包头：包长、头长、协议版本、操作码、序号
+HEADER = struct.Struct(">IHHII")
+OP_HEARTBEAT = 2
+OP_MESSAGE = 5
+OP_AUTH = 7
+
+
+def pack(op: int, body: bytes = b"") -> bytes:
+    return HEADER.pack(HEADER.size + len(body), HEADER.size, 1, op, 1) + body
+
+
+def unpack(data: bytes) -> Iterator[Tuple[int, bytes]]:
+    """
+    拆分弹幕协议数据包，压缩包会被递归解压
+
+    Args:
+        data (bytes): 数据
+
+    Returns:
+        操作码与包体
+    """
+    while len(data) >= HEADER.size:
+        length, header_length, version, op, _ = HEADER.unpack_from(data)
+        body, data = data[header_length:length], data[length:]
+        if op == OP_MESSAGE and version == 2:
+            yield from unpack(zlib.decompress(body))
+        elif op == OP_MESSAGE and version == 3:
+            yield from unpack(brotli.decompress(body))
+        else:
+            yield op, body
+
+
+class BroadcastWatcher(Watcher):
+    """
+    弹幕广播连接
+
+    收到 LIVE 或 PREPARING 消息时立即刷新房间状态，连接断开时按退避重连，并以较长间隔轮询兜底
+    """
+
+    interval = float(os.environ.get("LIVE_FALLBACK_POLL", 60))
+    # 连接保持超过该时长（秒）才重置退避
+    stable = 60
+
+    async def run(self):
+        fallback = asyncio.create_task(self.poll())
+        try:
+            backoff = 1.0
+            while True:
+                start = time.monotonic()
+                try:
+                    await self.listen()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    pass
+                # 上游正常关闭连接时同样退避，避免频繁重连
+                if time.monotonic() - start >= self.stable:
+                    backoff = 1.0
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+        finally:
+            fallback.cancel()
+
+    async def poll(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+    async def confirm(self):
+        # 上游消息可能先于房间信息更新，未变化时稍后重试
+        for _ in range(5):
+            if await self.refresh():
+                return
+            await asyncio.sleep(1)
+
+    async def listen(self):
+        async with httpx.AsyncClient() as session:
+            resp = await session.get(f"{BILIBILI_LIVE_API}/room/v1/Room/room_init", params={"id": self.roomid}, headers=HEADERS)
+        roomid = resp.json()["data"]["room_id"]
+        auth = {"uid": 0, "roomid": roomid, "protover": 3 if brotli is not None else 2, "platform": "web", "type": 2}
+        async with websockets.connect(BILIBILI_BROADCAST) as ws:
+            await ws.send(pack(OP_AUTH, json.dumps(auth).encode("utf-8")))
+
+            async def heartbeat():
+                while True:
+                    await ws.send(pack(OP_HEARTBEAT))
+                    await asyncio.sleep(30)
+
+            task = asyncio.create_task(heartbeat())
+            try:
+                async for data in ws:
+                    for op, body in unpack(data):
+                        if op != OP_MESSAGE:
+                            continue
+                        cmd = json.loads(body).get("cmd", "")
+                        if cmd in ("LIVE", "PREPARING"):
+                            await self.confirm()
+            finally:
+                task.cancel()
+
+
+watchers: Dict[int, Watcher] = {}
+
+
+def get_watcher(roomid: int) -> Watcher:
+    """
+    获取房间的监听，环境变量 `LIVE_WATCHER` 为 `poll` 或未安装 websockets 时使用轮询
+
+    Args:
+        roomid (int): 房间号
+
+    Returns:
+        监听
+    """
+    if roomid not in watchers:
+        if websockets is None or os.environ.get("LIVE_WATCHER", "broadcast") == "poll":
+            watchers[roomid] = PollingWatcher(roomid)
+        else:
+            watchers[roomid] = BroadcastWatcher(roomid)
+    return watchers[roomid]
+
+
+@router.get("/{roomid}/events")
+async def subscribe_room_events(roomid: int):
+    """
+    以 SSE 订阅房间开播与下播事件
+
+    事件数据与 `/{roomid}` 的响应相同，`start` 表示开播，`stop` 表示未开播
+    """
+    watcher = get_watcher(roomid)
+    queue = watcher.subscribe()
+
+    async def events():
+        try:
+            while True:
+                try:
+                    status = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                event = "start" if status["code"] == 0 else "stop"
+                yield f"event: {event}\ndata: {json.dumps(status, ensure_ascii=False)}\n\n"
+        finally:
+            watcher.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.websocket("/{roomid}/ws")
+async def subscribe_room_websocket(websocket: WebSocket, roomid: int):
+    """
+    以 WebSocket 订阅房间开播与下播事件，每条消息与 `/{roomid}` 的响应相同
+    """
+    await websocket.accept()
+    watcher = get_watcher(roomid)
+    queue = watcher.subscribe()
+
+    async def forward():
+        while True:
+            await websocket.send_json(await queue.get())
+
+    task = asyncio.create_task(forward())
+    try:
+        # 客户端消息仅用于检测断开
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        task.cancel()
+        watcher.unsubscribe(queue)
@@ -1,14 +1,28 @@
+import asyncio
 import json
 import os
 import sys
+from contextlib import asynccontextmanager
 from importlib import import_module
 from pathlib import Path
 from typing import List, Optional
 
 import uvicorn
-from fastapi import APIRouter, FastAPI
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import PlainTextResponse
+
+from utils import (
+    AdmissionMiddleware,
+    Budget,
+    CompressionMiddleware,
+    JSONResponse,
+    MetricsMiddleware,
+    StaticAssets,
+    create_profiler,
+    registry,
+    report,
+    run_warmups,
+)
 
 __dir__ = Path(__file__).parent
 exclude: List[str] = json.loads(os.environ.get("EXCLUDE", "[]"))
@@ -56,15 +70,132 @@ def auto_include_router(app: FastAPI, folder: str):
                     app.include_router(router, prefix=f"/{relative}/{dir}")
 
 
-app = FastAPI()
+profiler = create_profiler()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 在工作进程内启动，预加载模式下 fork 前创建的线程不会被继承
+    if profiler is not None:
+        profiler.start()
+    # 后台并行预热，期间 /ready 返回 503
+    app.state.warmup = asyncio.create_task(run_warmups())
+    yield
+
+
+app = FastAPI(default_response_class=JSONResponse, lifespan=lifespan)
+app.add_middleware(CompressionMiddleware, minimum_size=1024, exclude=("/api/file", "/api/avatar"))
+# 只限制昂贵的路由，/api/live 等廉价路由不排队
+app.add_middleware(
+    AdmissionMiddleware,
+    budgets={
+        "/api/avatar": Budget(concurrency=1, queue=2, timeout=30, memory=160 << 20),
+        "/api/deepseek/completion": Budget(concurrency=2, queue=4, timeout=30),
+        "/api/deepseek/create_pow_challenge": Budget(concurrency=2, queue=8),
+        "/api/deepseek/compute_pow_answer": Budget(concurrency=2, queue=8),
+        "/api/assistant": Budget(concurrency=4, queue=8, timeout=30),
+        "/api/acrnm": Budget(concurrency=4, queue=16),
+        "/api/acrnm/appearances": Budget(concurrency=2, queue=8, timeout=120),
+        "/api/file": Budget(concurrency=4, queue=8),
+    },
+)
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics/profile", include_in_schema=False)
+async def profile():
+    if profiler is None:
+        return PlainTextResponse("采样分析器未启用，请设置环境变量 PROFILE_INTERVAL\n", status_code=404)
+    return PlainTextResponse(profiler.render())
+
+
+@app.get("/ready", include_in_schema=False)
+async def readiness():
+    r = report()
+    return JSONResponse(r, status_code=200 if r["ready"] else 503)
+
+
+@app.post("/initialize", include_in_schema=False)
+async def initialize(request: Request):
+    # 函数计算的初始化回调，等待预热完成后返回
+    await asyncio.shield(request.app.state.warmup)
+    return JSONResponse(report())
+
+
+favicon_assets = StaticAssets(files=[__dir__ / "favicon.ico"])
+
+
+@app.api_route("/favicon.ico", methods=["GET", "HEAD"], include_in_schema=False)
+async def favicon(request: Request):
+    return favicon_assets.response("favicon.ico", request.headers, request.method)
+
+
+def create_app() -> FastAPI:
+    """
+    导入路由组并挂载静态文件，重复调用时直接返回应用
+
+    Returns:
+        应用
+    """
+    if not getattr(app.state, "created", False):
+        auto_include_router(app, "api")
+        app.mount("/", StaticAssets(directory=__dir__ / "web", html=True))
+        app.state.created = True
+    return app
+
+
+def serve(host: str = "0.0.0.0", port: int = 9000, workers: int = 1, preload: bool = True):
+    """
+    启动服务
+
+    多进程时优先使用 gunicorn 预加载应用，路由表与可以跨 fork 的预热结果在 fork 前加载，由各工作进程以写时复制方式共享；
+    未安装 gunicorn 或不预加载时由 uvicorn 启动多个工作进程，各自加载应用
+
+    Args:
+        host (str, optional): 监听地址
+        port (int, optional): 监听端口
+        workers (int, optional): 工作进程数，为 0 时等于 CPU 核数
+        preload (bool, optional): 是否预加载应用
+    """
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    # 让工作进程与共享存储使用相同的进程数判断
+    os.environ["WORKERS"] = str(workers)
+    if workers == 1:
+        return uvicorn.run(create_app(), host=host, port=port)
+    if preload:
+        try:
+            from gunicorn.app.base import BaseApplication
+        except ImportError:
+            pass
+        else:
+
+            class Server(BaseApplication):
+                def load_config(self):
+                    self.cfg.set("bind", f"{host}:{port}")
+                    self.cfg.set("workers", workers)
+                    self.cfg.set("worker_class", "uvicorn.workers.UvicornWorker")
+                    self.cfg.set("preload_app", True)
+                    self.cfg.set("timeout", 60)
 
+                def load(self):
+                    app = create_app()
+                    # 在 fork 前预热，工作进程以写时复制方式共享加载结果，之后各自的预热会直接返回
+                    asyncio.run(run_warmups(preload=True))
+                    return app
 
-@app.get("/favicon.ico")
-async def favicon():
-    return FileResponse("favicon.ico")
+            return Server().run()
+    uvicorn.run("index:create_app", factory=True, host=host, port=port, workers=workers)
 
 
 if __name__ == "__main__":
-    auto_include_router(app, "api")
-    app.mount("/", StaticFiles(directory=__dir__ / "web", html=True))
-    uvicorn.run(app, host="0.0.0.0", port=9000)
+    serve(
+        port=int(os.environ.get("PORT", 9000)),
+        workers=int(os.environ.get("WORKERS", 1)),
+        preload=os.environ.get("PRELOAD", "1") != "0",
+    )
@@ -0,0 +1,8 @@
+from .admission import AdmissionMiddleware, Budget
+from .compression import CompressionMiddleware
+from .metrics import MetricsMiddleware, create_profiler, registry, span
+from .responses import JSONResponse
+from .singleflight import Group, singleflight
+from .static import StaticAssets
+from .storage import MemoryStorage, SQLiteStorage, open_storage
+from .warmup import cache_dir, ready, report, run_warmups, warmup
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import math
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .metrics import Counter, Gauge, registry
+from .responses import JSONResponse
+
+rejections: Counter = registry.register(Counter("admission_rejections_total", "准入控制拒绝的请求数"))
+queued: Gauge = registry.register(Gauge("admission_queued", "准入控制排队中的请求数"))
+
+
+def reclaimable_memory(stat_file: str, key: str) -> int:
+    """
+    从 cgroup 的 memory.stat 读取可回收的页缓存
+
+    Args:
+        stat_file (str): memory.stat 路径
+        key (str): 不活跃文件页缓存的字段名
+
+    Returns:
+        可回收字节数，无法获取时返回 0
+    """
+    try:
+        with open(stat_file) as fp:
+            for line in fp:
+                name, _, value = line.partition(" ")
+                if name == key:
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def available_memory() -> Optional[int]:
+    """
+    获取可用内存，优先读取 cgroup 限额，其次为 /proc/meminfo
+
+    cgroup 的用量包含依赖库、数据库与模型文件等页缓存，其中不活跃的部分会在内存紧张时回收，因此视为可用
+
+    Returns:
+        可用字节数，无法获取时返回空
+    """
+    for limit_file, usage_file, stat_file, key in (
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory.stat", "inactive_file"),
+        ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes", "/sys/fs/cgroup/memory/memory.stat", "total_inactive_file"),
+    ):
+        try:
+            with open(limit_file) as fp:
+                limit = fp.read().strip()
+            with open(usage_file) as fp:
+                usage = int(fp.read().strip())
+        except (OSError, ValueError):
+            continue
+        # 未设置限额时为 max 或一个极大值
+        if limit.isdigit() and int(limit) < 1 << 60:
+            return int(limit) - max(usage - reclaimable_memory(stat_file, key), 0)
+    try:
+        with open("/proc/meminfo") as fp:
+            for line in fp:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+@dataclass
+class Budget:
+    """
+    路由的并发预算
+
+    Args:
+        concurrency (int): 同时处理的请求数
+        queue (int, optional): 最多排队的请求数，超出时返回 429
+        timeout (float, optional): 最长排队时间（秒），超时返回 503
+        memory (int, optional): 每个请求预计占用的内存，加上请求体大小后超过可用内存时返回 503
+        reserve (int, optional): 始终保留的可用内存
+    """
+
+    concurrency: int
+    queue: int = 0
+    timeout: float = 10.0
+    memory: int = 0
+    reserve: int = 64 << 20
+    waiting: int = field(default=0, init=False)
+    duration: float = field(default=1.0, init=False)
+    semaphore: asyncio.Semaphore = field(init=False, repr=False)
+
+    def __post_init__(self):
+        if self.concurrency < 1:
+            raise ValueError(f"concurrency 必须为正整数: {self.concurrency}")
+        if self.queue < 0 or self.timeout <= 0:
+            raise ValueError(f"queue 不能为负数且 timeout 必须为正数: {self.queue}, {self.timeout}")
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    def retry_after(self) -> int:
+        # 按平均耗时估计排到的时间
+        return max(1, math.ceil(self.duration * (self.waiting + 1) / self.concurrency))
+
+    def record(self, duration: float):
+        self.duration = 0.8 * self.duration + 0.2 * duration
+
+
+class AdmissionMiddleware:
+    """
+    准入控制
+
+    按路径前缀（最长匹配）为路由分配独立的并发与排队预算，未配置的路由不受限制，因此廉价路由不会排在昂贵路由之后。
+    超出预算时立即返回带 Retry-After 的 429 或 503
+
+    Args:
+        app (ASGIApp): 应用
+        budgets (Dict[str, Budget]): 路径前缀到预算的映射，可被环境变量 `ADMISSION` 中的 JSON 覆盖，
+            例如 `{"/api/avatar": {"concurrency": 2, "queue": 4}}`
+    """
+
+    def __init__(self, app: ASGIApp, budgets: Dict[str, Budget]):
+        self.app = app
+        self.budgets = dict(budgets)
+        for prefix, options in json.loads(os.environ.get("ADMISSION", "{}")).items():
+            self.budgets[prefix] = Budget(**options)
+        # 最长前缀优先
+        self.prefixes = sorted(self.budgets, key=len, reverse=True)
+
+    def match(self, path: str) -> Optional[str]:
+        for prefix in self.prefixes:
+            if path == prefix or path.startswith(prefix.rstrip("/") + "/"):
+                return prefix
+        return None
+
+    async def reject(self, scope: Scope, receive: Receive, send: Send, prefix: str, status: int, reason: str, detail: str, retry_after: int):
+        rejections.inc(route=prefix, reason=reason)
+        # 请求未进入路由，按前缀记录路由指标
+        scope["metrics.route"] = prefix
+        response = JSONResponse({"detail": detail}, status_code=status, headers={"Retry-After": str(retry_after)})
+        await response(scope, receive, send)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        prefix = self.match(scope["path"]) if scope["type"] == "http" else None
+        if prefix is None:
+            return await self.app(scope, receive, send)
+        budget = self.budgets[prefix]
+
+        if budget.memory > 0 or scope["method"] in ("POST", "PUT"):
+            needed = budget.memory + int(Headers(scope=scope).get("content-length", 0) or 0)
+            available = available_memory()
+            if needed > 0 and available is not None and available - needed < budget.reserve:
+                return await self.reject(scope, receive, send, prefix, 503, "memory", "可用内存不足", budget.retry_after())
+
+        if budget.semaphore.locked():
+            if budget.waiting >= budget.queue:
+                return await self.reject(scope, receive, send, prefix, 429, "queue_full", "请求过多", budget.retry_after())
+            budget.waiting += 1
+            queued.inc(route=prefix)
+            try:
+                await asyncio.wait_for(budget.semaphore.acquire(), timeout=budget.timeout)
+            except asyncio.TimeoutError:
+                return await self.reject(scope, receive, send, prefix, 503, "queue_timeout", "排队超时", budget.retry_after())
+            finally:
+                budget.waiting -= 1
+                queued.dec(route=prefix)
+        else:
+            await budget.semaphore.acquire()
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            budget.semaphore.release()
+            budget.record(time.perf_counter() - start)
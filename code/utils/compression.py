@@ -0,0 +1,183 @@
+import zlib
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 已压缩或不宜压缩的媒体类型
+INCOMPRESSIBLE = ("image/", "video/", "audio/", "font/woff", "application/zip", "application/gzip", "application/x-7z", "application/x-rar", "application/zstd", "text/event-stream")
+
+
+class Compressor(ABC):
+    """
+    流式压缩器
+    """
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        pass
+
+    @abstractmethod
+    def flush(self) -> bytes:
+        pass
+
+    @abstractmethod
+    def finish(self) -> bytes:
+        pass
+
+
+class GzipCompressor(Compressor):
+    def __init__(self, level: int = 6):
+        self.c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.c.compress(data)
+
+    def flush(self) -> bytes:
+        return self.c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.c.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor(Compressor):
+    def __init__(self, quality: int = 5):
+        self.c = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.c.process(data)
+
+    def flush(self) -> bytes:
+        return self.c.flush()
+
+    def finish(self) -> bytes:
+        return self.c.finish()
+
+
+class ZstdCompressor(Compressor):
+    def __init__(self, level: int = 3):
+        self.c = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.c.compress(data)
+
+    def flush(self) -> bytes:
+        return self.c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self.c.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+# 按服务端偏好排序，未安装的算法不参与协商
+ENCODINGS: Dict[str, Callable[[], Compressor]] = {}
+if brotli is not None:
+    ENCODINGS["br"] = BrotliCompressor
+if zstandard is not None:
+    ENCODINGS["zstd"] = ZstdCompressor
+ENCODINGS["gzip"] = GzipCompressor
+
+
+def negotiate(accept_encoding: str, available: Iterable[str] = ENCODINGS) -> Optional[str]:
+    """
+    根据 Accept-Encoding 选择压缩算法
+
+    Args:
+        accept_encoding (str): 请求头
+        available (Iterable[str], optional): 可用算法，按偏好排序
+
+    Returns:
+        算法名，无可用算法时返回空
+    """
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    wildcard = accepted.get("*", 0.0)
+    for name in available:
+        if accepted.get(name, wildcard) > 0:
+            return name
+    return None
+
+
+class CompressionMiddleware:
+    """
+    按 Accept-Encoding 协商压缩响应
+
+    小于 `minimum_size` 的响应、已设置 Content-Encoding 或 `Cache-Control: no-transform` 的响应、不宜压缩的媒体类型以及 `exclude` 中的路径前缀不会被压缩
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, exclude: Tuple[str, ...] = ()):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.exclude = exclude
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude):
+            return await self.app(scope, receive, send)
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start: Optional[Message] = None
+        compressor: Optional[Compressor] = None
+        passthrough = False
+
+        async def wrapped_send(message: Message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+
+            body: bytes = message.get("body", b"")
+            more_body: bool = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start["headers"])
+                media_type = headers.get("content-type", "")
+                if (
+                    "content-encoding" in headers
+                    or "no-transform" in headers.get("cache-control", "")
+                    or media_type.startswith(INCOMPRESSIBLE)
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    passthrough = True
+                    await send(start)
+                    return await send(message)
+                compressor = ENCODINGS[encoding]()
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    body = compressor.compress(body) + compressor.finish()
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    return await send({"type": "http.response.body", "body": body})
+                await send(start)
+
+            if more_body:
+                body = compressor.compress(body) + compressor.flush()
+            else:
+                body = compressor.compress(body) + compressor.finish()
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, wrapped_send)
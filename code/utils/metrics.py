@@ -0,0 +1,280 @@
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from starlette.routing import Route
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def format_labels(labels: Labels, **extra: str) -> str:
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs) + "}"
+
+
+class Metric(ABC):
+    """
+    指标基类
+    """
+
+    type = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        pass
+
+    def render(self) -> str:
+        with self.lock:
+            lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    计数器
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.values: Dict[Labels, float] = defaultdict(float)
+
+    def inc(self, value: float = 1, **labels: str):
+        with self.lock:
+            self.values[tuple(labels.items())] += value
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}{format_labels(labels)} {value}"
+
+
+class Gauge(Counter):
+    """
+    仪表
+    """
+
+    type = "gauge"
+
+    def dec(self, value: float = 1, **labels: str):
+        self.inc(-value, **labels)
+
+
+class Histogram(Metric):
+    """
+    直方图
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+        self.values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(labels.items())
+        with self.lock:
+            # 各桶计数 + 溢出桶 + 总和
+            counts = self.values.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self) -> Iterator[str]:
+        for labels, counts in self.values.items():
+            total = 0.0
+            for le, count in zip(self.buckets, counts):
+                total += count
+                yield f"{self.name}_bucket{format_labels(labels, le=str(le))} {total}"
+            total += counts[-2]
+            yield f"{self.name}_bucket{format_labels(labels, le='+Inf')} {total}"
+            yield f"{self.name}_sum{format_labels(labels)} {counts[-1]}"
+            yield f"{self.name}_count{format_labels(labels)} {total}"
+
+
+class Registry:
+    """
+    指标注册表
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        return self.metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self.metrics.values()) + "\n"
+
+
+registry = Registry()
+request_duration: Histogram = registry.register(Histogram("http_request_duration_seconds", "HTTP 请求耗时"))
+requests_in_flight: Gauge = registry.register(Gauge("http_requests_in_flight", "正在处理的 HTTP 请求数"))
+responses_total: Counter = registry.register(Counter("http_responses_total", "HTTP 响应数"))
+stage_duration: Histogram = registry.register(Histogram("stage_duration_seconds", "路由内部阶段耗时"))
+
+
+@contextmanager
+def span(stage: str):
+    """
+    记录路由内部某一阶段的耗时，也可在线程中使用
+
+    Args:
+        stage (str): 阶段名，例如 `avatar.rembg`
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_duration.observe(time.perf_counter() - start, stage=stage)
+
+
+def route_path(scope: Scope) -> str:
+    """
+    获取请求对应的路由模板，避免路径参数使标签无限增长
+
+    需在路由匹配完成后调用，被包含的路由可能只记录了去掉前缀的路径，前缀由实际路径还原
+
+    Args:
+        scope (Scope): ASGI 作用域
+
+    Returns:
+        路由模板
+    """
+    # 未进入路由即被拒绝的请求由中间件直接指定标签
+    if "metrics.route" in scope:
+        return scope["metrics.route"]
+    route = scope.get("route")
+    if route is None and "endpoint" in scope and "app" in scope:
+        # Starlette 的路由（如 /openapi.json）只设置了 endpoint，从应用的路由表中查找
+        route = next((r for r in scope["app"].router.routes if isinstance(r, Route) and r.endpoint is scope["endpoint"]), None)
+    template = getattr(route, "path", None)
+    if template is None:
+        # 挂载的应用（如静态文件）只设置了 endpoint
+        if "endpoint" in scope:
+            return scope.get("root_path", "") + "/{path}"
+        return "unmatched"
+    path: str = scope["path"]
+    try:
+        rendered = template.format(**scope.get("path_params", {}))
+    except (KeyError, IndexError, ValueError):
+        return template
+    if path.endswith(rendered):
+        return path[: len(path) - len(rendered)] + template
+    return template
+
+
+class MetricsMiddleware:
+    """
+    记录每个路由的耗时直方图与响应状态码，以及正在处理的请求数
+
+    耗时统计到响应体发送完毕为止，流式响应同样适用
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status = "500"
+
+        async def wrapped_send(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        requests_in_flight.inc(method=method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, wrapped_send)
+        finally:
+            requests_in_flight.dec(method=method)
+            route = route_path(scope)
+            request_duration.observe(time.perf_counter() - start, method=method, route=route)
+            responses_total.inc(method=method, route=route, status=status)
+
+
+class Profiler:
+    """
+    采样分析器
+
+    后台线程定时采集所有线程的调用栈，输出可直接用于火焰图的折叠栈格式。
+    只有栈顶保留行号，每次输出后清空，不同调用栈的数量超过 `limit` 后新的调用栈计入 `(truncated)`，避免内存无限增长
+    """
+
+    limit = 10000
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: collections.Counter = collections.Counter()
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        ident = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == ident:
+                    continue
+                stack = [f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"]
+                frame = frame.f_back
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                with self.lock:
+                    if key not in self.stacks and len(self.stacks) >= self.limit:
+                        key = "(truncated)"
+                    self.stacks[key] += 1
+
+    def render(self) -> str:
+        """
+        输出并清空自上次输出以来的采样
+
+        Returns:
+            折叠栈
+        """
+        with self.lock:
+            stacks = self.stacks.most_common()
+            self.stacks = collections.Counter()
+        return "\n".join(f"{stack} {count}" for stack, count in stacks) + "\n"
+
+
+def create_profiler() -> Optional[Profiler]:
+    """
+    根据环境变量 `PROFILE_INTERVAL`（秒）创建采样分析器，未设置时返回空，需调用 `start` 启动
+
+    Returns:
+        采样分析器
+    """
+    interval = float(os.environ.get("PROFILE_INTERVAL", 0))
+    if interval <= 0:
+        return None
+    return Profiler(interval)
@@ -0,0 +1,22 @@
+import json
+from typing import Any
+
+from starlette.responses import JSONResponse as BaseJSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONResponse(BaseJSONResponse):
+    """
+    JSON 响应
+
+    安装了 orjson 时使用 orjson 序列化，否则与 Starlette 的实现一致
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
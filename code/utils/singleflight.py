@@ -0,0 +1,91 @@
+import asyncio
+import inspect
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Group:
+    """
+    请求合并组
+
+    同一时刻相同键的调用只会真正执行一次，其余调用等待同一个结果
+    """
+
+    def __init__(self):
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self.calls)
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        """
+        执行或加入一次调用
+
+        Args:
+            key (Hashable): 调用键
+            fn (Callable[..., Awaitable[T]]): 异步函数
+
+        Returns:
+            调用结果
+        """
+        future = self.calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn(*args, **kwargs))
+            self.calls[key] = future
+
+            def forget(f: asyncio.Future):
+                if self.calls.get(key) is f:
+                    del self.calls[key]
+
+            future.add_done_callback(forget)
+        # 某个客户端断开时不应取消其他等待者共享的调用
+        return await asyncio.shield(future)
+
+
+def make_key(fn: Callable, *args, **kwargs) -> Hashable:
+    """
+    按函数签名规范化参数生成键
+
+    位置参数与关键字参数会被绑定到形参名上，缺省参数会填入默认值
+
+    Args:
+        fn (Callable): 函数
+
+    Returns:
+        调用键
+    """
+    bound = inspect.signature(fn).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return tuple(bound.arguments.items())
+
+
+def singleflight(key: Optional[Callable[..., Hashable]] = None):
+    """
+    请求合并装饰器
+
+    被装饰的协程函数在并发调用参数相同时只会执行一次，可直接用于路由函数
+
+    Args:
+        key (Optional[Callable[..., Hashable]], optional): 自定义键函数，接收与被装饰函数相同的参数，不指定则按签名规范化全部参数
+
+    Returns:
+        装饰器
+    """
+
+    def decorator(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        group = Group()
+
+        @wraps(fn)
+        async def wrapper(*args, **kwargs) -> Any:
+            if key is None:
+                k = make_key(fn, *args, **kwargs)
+            else:
+                k = key(*args, **kwargs)
+            return await group.do(k, fn, *args, **kwargs)
+
+        wrapper.group = group
+        return wrapper
+
+    return decorator
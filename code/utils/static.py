@@ -0,0 +1,233 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, PlainTextResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from .compression import INCOMPRESSIBLE, negotiate
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 预压缩文件后缀
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+# 未压缩的图片格式
+UNCOMPRESSED_IMAGES = ("image/svg+xml", "image/vnd.microsoft.icon", "image/x-icon", "image/bmp")
+
+
+def compressible(media_type: str) -> bool:
+    return media_type.startswith(UNCOMPRESSED_IMAGES) or not media_type.startswith(INCOMPRESSIBLE)
+
+
+def compress(encoding: str, data: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+@dataclass
+class Asset:
+    """
+    静态资源
+
+    小文件的内容及其压缩版本常驻内存，大文件只记录路径
+    """
+
+    path: Path
+    media_type: str
+    etag: str
+    cache_control: str
+    content: Optional[bytes] = None
+    variants: Dict[str, bytes] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: Path, max_size: int, max_age: int) -> "Asset":
+        """
+        读取文件并准备压缩版本，优先使用部署时生成的同名 `.br` 与 `.gz` 文件
+
+        Args:
+            path (Path): 文件路径
+            max_size (int): 常驻内存的最大文件大小
+            max_age (int): 非 HTML 文件的缓存时间（秒）
+
+        Returns:
+            静态资源
+        """
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type in ("application/javascript", "application/json"):
+            media_type += "; charset=utf-8"
+        # HTML 不带指纹，每次都需要重新验证
+        cache_control = "no-cache" if media_type.startswith("text/html") else f"public, max-age={max_age}"
+        cache_control += ", no-transform"
+
+        if path.stat().st_size > max_size:
+            digest = hashlib.sha256()
+            with open(path, "rb") as fp:
+                for chunk in iter(lambda: fp.read(1 << 20), b""):
+                    digest.update(chunk)
+            return cls(path, media_type, f'"{digest.hexdigest()[:20]}"', cache_control)
+
+        content = path.read_bytes()
+        asset = cls(path, media_type, f'"{hashlib.sha256(content).hexdigest()[:20]}"', cache_control, content)
+        if not compressible(media_type):
+            return asset
+        for encoding, suffix in SUFFIXES.items():
+            prebuilt = path.with_name(path.name + suffix)
+            if prebuilt.is_file() and prebuilt.stat().st_mtime >= path.stat().st_mtime:
+                data = prebuilt.read_bytes()
+            elif encoding == "br" and brotli is None:
+                continue
+            else:
+                data = compress(encoding, content)
+            # 压缩后没有变小就不必提供
+            if len(data) < len(content):
+                asset.variants[encoding] = data
+        return asset
+
+    def variant_etag(self, encoding: Optional[str]) -> str:
+        # 强校验值需区分不同编码的表示
+        if encoding is None:
+            return self.etag
+        return self.etag[:-1] + "-" + encoding + '"'
+
+    def response(self, headers: Headers, method: str = "GET") -> Response:
+        """
+        生成响应，按 Accept-Encoding 选择压缩版本，If-None-Match 命中时返回 304
+
+        Args:
+            headers (Headers): 请求头
+            method (str, optional): 请求方法
+
+        Returns:
+            响应
+        """
+        if self.content is None:
+            return FileResponse(self.path, media_type=self.media_type, headers={"ETag": self.etag, "Cache-Control": self.cache_control}, method=method)
+
+        encoding = negotiate(headers.get("accept-encoding", ""), self.variants) if self.variants else None
+        etag = self.variant_etag(encoding)
+        resp_headers = {"ETag": etag, "Cache-Control": self.cache_control}
+        if self.variants:
+            resp_headers["Vary"] = "Accept-Encoding"
+
+        if_none_match = headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if "*" in tags or etag in tags:
+                return Response(status_code=304, headers=resp_headers)
+
+        if encoding is None:
+            body = self.content
+        else:
+            body = self.variants[encoding]
+            resp_headers["Content-Encoding"] = encoding
+        if method == "HEAD":
+            resp_headers["Content-Length"] = str(len(body))
+            return Response(status_code=200, headers=resp_headers, media_type=self.media_type)
+        return Response(body, headers=resp_headers, media_type=self.media_type)
+
+
+class StaticAssets:
+    """
+    静态资源服务
+
+    启动时扫描全部文件并计算指纹，只提供扫描到的文件
+
+    Args:
+        directory (Optional[Union[str, Path]], optional): 目录
+        files (Iterable[Union[str, Path]], optional): 额外的单个文件，以文件名访问
+        html (bool, optional): 目录请求返回其中的 index.html，找不到文件时返回 404.html
+        max_size (int, optional): 常驻内存的最大文件大小
+        max_age (int, optional): 非 HTML 文件的缓存时间（秒）
+    """
+
+    def __init__(
+        self,
+        directory: Optional[Union[str, Path]] = None,
+        files: Iterable[Union[str, Path]] = (),
+        html: bool = False,
+        max_size: int = 1 << 20,
+        max_age: int = 604800,
+    ):
+        self.html = html
+        self.assets: Dict[str, Asset] = {}
+        if directory is not None:
+            directory = Path(directory)
+            for dirpath, _, filenames in os.walk(directory):
+                for filename in filenames:
+                    path = Path(dirpath) / filename
+                    if path.suffix in (".br", ".gz") and path.with_suffix("").is_file():
+                        continue
+                    self.assets[path.relative_to(directory).as_posix()] = Asset.load(path, max_size, max_age)
+        for file in files:
+            path = Path(file)
+            self.assets[path.name] = Asset.load(path, max_size, max_age)
+
+    def lookup(self, path: str) -> Optional[Asset]:
+        path = path.strip("/")
+        if path in self.assets:
+            return self.assets[path]
+        if self.html:
+            return self.assets.get(f"{path}/index.html".lstrip("/"))
+        return None
+
+    def response(self, path: str, headers: Headers, method: str = "GET") -> Response:
+        """
+        获取文件的响应
+
+        Args:
+            path (str): 相对路径
+            headers (Headers): 请求头
+            method (str, optional): 请求方法
+
+        Returns:
+            响应
+        """
+        if method not in ("GET", "HEAD"):
+            return PlainTextResponse("Method Not Allowed", status_code=405)
+        asset = self.lookup(path)
+        if asset is not None:
+            return asset.response(headers, method)
+        if self.html and "404.html" in self.assets:
+            resp = self.assets["404.html"].response(Headers(), method)
+            resp.status_code = 404
+            return resp
+        return PlainTextResponse("Not Found", status_code=404)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        path: str = scope["path"]
+        root_path: str = scope.get("root_path", "")
+        if path.startswith(root_path):
+            path = path[len(root_path) :]
+        response = self.response(path, Headers(scope=scope), scope["method"])
+        await response(scope, receive, send)
+
+
+def build(directory: Union[str, Path]):
+    """
+    部署前在文件旁生成 `.br` 与 `.gz` 压缩版本，实例启动时直接读取
+
+    Args:
+        directory (Union[str, Path]): 目录
+    """
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = Path(dirpath) / filename
+            if path.suffix in (".br", ".gz"):
+                continue
+            media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            if not compressible(media_type):
+                continue
+            content = path.read_bytes()
+            for encoding, suffix in SUFFIXES.items():
+                if encoding == "br" and brotli is None:
+                    continue
+                path.with_name(path.name + suffix).write_bytes(compress(encoding, content))
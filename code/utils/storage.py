@@ -0,0 +1,206 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, MutableMapping, Optional, Tuple
+
+
+class MemoryStorage(MutableMapping):
+    """
+    进程内存储
+
+    Args:
+        namespace (str): 命名空间，仅用于与 `SQLiteStorage` 保持一致
+        ttl (Optional[float], optional): 过期时间（秒），不指定则永不过期
+    """
+
+    def __init__(self, namespace: str, ttl: Optional[float] = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.items: Dict[str, Tuple[Any, Optional[float]]] = {}
+        # 可能在工作线程中调用
+        self.lock = threading.Lock()
+
+    def __getitem__(self, key: str) -> Any:
+        with self.lock:
+            value, expire = self.items[key]
+            if expire is not None and expire <= time.time():
+                del self.items[key]
+                raise KeyError(key)
+            return value
+
+    def __setitem__(self, key: str, value: Any):
+        now = time.time()
+        with self.lock:
+            if self.ttl is not None:
+                # 顺带清理过期数据
+                for k in [k for k, (_, expire) in self.items.items() if expire is not None and expire <= now]:
+                    del self.items[k]
+            self.items[key] = (value, None if self.ttl is None else now + self.ttl)
+
+    def __delitem__(self, key: str):
+        with self.lock:
+            del self.items[key]
+
+    def __iter__(self) -> Iterator[str]:
+        now = time.time()
+        with self.lock:
+            return iter([k for k, (_, expire) in self.items.items() if expire is None or expire > now])
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def lease(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        获取或续期租约
+
+        Args:
+            key (str): 租约名
+            owner (str): 持有者
+            ttl (float): 有效期（秒）
+
+        Returns:
+            是否持有租约
+        """
+        now = time.time()
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and item[0] != owner and item[1] is not None and item[1] > now:
+                return False
+            self.items[key] = (owner, now + ttl)
+            return True
+
+
+class SQLiteStorage(MutableMapping):
+    """
+    基于本地 SQLite 的跨进程存储
+
+    同一主机上的多个工作进程共享同一个数据库文件，值使用 pickle 序列化
+
+    Args:
+        namespace (str): 命名空间
+        ttl (Optional[float], optional): 过期时间（秒），不指定则永不过期
+        path (Optional[Path], optional): 数据库路径，不指定则使用 `storage_path()`
+    """
+
+    local = threading.local()
+
+    def __init__(self, namespace: str, ttl: Optional[float] = None, path: Optional[Path] = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.path = str(path or storage_path())
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程使用，也不能在 fork 后继续使用（预加载时存储在主进程中创建），因此按进程与线程各自打开
+        connections: Dict[Tuple[int, str], sqlite3.Connection] = self.local.__dict__.setdefault("connections", {})
+        key = (os.getpid(), self.path)
+        if key not in connections:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS kv (namespace TEXT, key TEXT, value BLOB, expire REAL, PRIMARY KEY (namespace, key))")
+            connections[key] = db
+        return connections[key]
+
+    def __getitem__(self, key: str) -> Any:
+        row = self.db.execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expire IS NULL OR expire > ?)",
+            (self.namespace, key, time.time()),
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return pickle.loads(row[0])
+
+    def __setitem__(self, key: str, value: Any):
+        now = time.time()
+        expire = None if self.ttl is None else now + self.ttl
+        self.db.execute(
+            "INSERT OR REPLACE INTO kv (namespace, key, value, expire) VALUES (?, ?, ?, ?)",
+            (self.namespace, key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expire),
+        )
+        # 顺带清理过期数据
+        self.db.execute("DELETE FROM kv WHERE namespace = ? AND expire <= ?", (self.namespace, now))
+
+    def __delitem__(self, key: str):
+        if self.db.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (self.namespace, key)).rowcount == 0:
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        row = self.db.execute(
+            "SELECT 1 FROM kv WHERE namespace = ? AND key = ? AND (expire IS NULL OR expire > ?)",
+            (self.namespace, key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def __iter__(self) -> Iterator[str]:
+        rows = self.db.execute(
+            "SELECT key FROM kv WHERE namespace = ? AND (expire IS NULL OR expire > ?)",
+            (self.namespace, time.time()),
+        ).fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        return self.db.execute(
+            "SELECT COUNT(*) FROM kv WHERE namespace = ? AND (expire IS NULL OR expire > ?)",
+            (self.namespace, time.time()),
+        ).fetchone()[0]
+
+    def lease(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        获取或续期租约，同一时刻只有一个进程能够持有
+
+        Args:
+            key (str): 租约名
+            owner (str): 持有者
+            ttl (float): 有效期（秒）
+
+        Returns:
+            是否持有租约
+        """
+        now = time.time()
+        value = pickle.dumps(owner, pickle.HIGHEST_PROTOCOL)
+        # 租约不存在、已过期或本来就由自己持有时才写入
+        cursor = self.db.execute(
+            "INSERT INTO kv (namespace, key, value, expire) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, expire = excluded.expire "
+            "WHERE kv.value = excluded.value OR kv.expire <= ?",
+            (self.namespace, key, value, now + ttl, now),
+        )
+        return cursor.rowcount == 1
+
+
+def storage_path() -> Path:
+    """
+    获取共享数据库路径，优先使用环境变量 `STORAGE_PATH`
+
+    数据库应放在本地磁盘上，NAS 等网络文件系统上的文件锁不可靠
+
+    Returns:
+        数据库路径
+    """
+    if "STORAGE_PATH" in os.environ:
+        return Path(os.environ["STORAGE_PATH"])
+    return Path(tempfile.gettempdir()) / "serverless-nana7mi-link.sqlite3"
+
+
+def open_storage(namespace: str, ttl: Optional[float] = None) -> MutableMapping:
+    """
+    打开存储
+
+    环境变量 `STORAGE` 为 `sqlite` 或 `memory`，未设置时多进程（`WORKERS` 大于 1）使用 SQLite，否则使用进程内存储
+
+    Args:
+        namespace (str): 命名空间
+        ttl (Optional[float], optional): 过期时间（秒）
+
+    Returns:
+        存储
+    """
+    backend = os.environ.get("STORAGE") or ("sqlite" if int(os.environ.get("WORKERS", 1)) > 1 else "memory")
+    if backend == "sqlite":
+        return SQLiteStorage(namespace, ttl)
+    return MemoryStorage(namespace, ttl)
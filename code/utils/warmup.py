@@ -0,0 +1,117 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+
+tasks: Dict[str, Callable[[], object]] = {}
+status: Dict[str, dict] = {}
+# 可以在 fork 前预热、由工作进程共享的子系统
+preloadable: Set[str] = set()
+
+
+def warmup(name: str, preload: bool = True):
+    """
+    注册预热函数
+
+    预热函数在工作线程中执行，需可重复调用
+
+    Args:
+        name (str): 子系统名
+        preload (bool, optional): 是否可以在 fork 前预热，加载结果依赖线程等不能跨 fork 的资源时应为 `False`
+
+    Returns:
+        装饰器
+    """
+
+    def decorator(fn: Callable[[], object]) -> Callable[[], object]:
+        tasks[name] = fn
+        if preload:
+            preloadable.add(name)
+        return fn
+
+    return decorator
+
+
+def selected() -> List[str]:
+    """
+    获取需要预热的子系统，环境变量 `WARMUP` 为逗号分隔的子系统名，未设置时预热全部已注册的子系统
+
+    Returns:
+        子系统名列表
+    """
+    names = os.environ.get("WARMUP")
+    if names is None:
+        return list(tasks)
+    return [name for name in (n.strip() for n in names.split(",")) if name in tasks]
+
+
+async def run_warmups(names: Optional[List[str]] = None, preload: bool = False):
+    """
+    并行预热子系统
+
+    Args:
+        names (Optional[List[str]], optional): 子系统名列表，不指定则使用 `selected()`
+        preload (bool, optional): 是否为 fork 前的预热，为 `True` 时只预热可以预加载的子系统
+    """
+
+    async def run(name: str):
+        status[name] = {"ready": False}
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(tasks[name])
+            status[name] = {"ready": True, "seconds": time.perf_counter() - start}
+        except Exception as e:
+            msg = type(e).__name__
+            if str(e) != "":
+                msg += f": {str(e)}"
+            status[name] = {"ready": False, "seconds": time.perf_counter() - start, "error": msg}
+
+    if names is None:
+        names = selected()
+    if preload:
+        names = [name for name in names if name in preloadable]
+    await asyncio.gather(*map(run, names))
+
+
+def ready() -> bool:
+    """
+    判断预热是否结束
+
+    预热出错的子系统仍会在首次请求时加载，因此同样视为结束，错误信息只在 `report()` 中给出，避免健康检查反复回收实例
+
+    Returns:
+        所有需要预热的子系统是否都已完成或出错
+    """
+    return all(name in status and (status[name]["ready"] or "error" in status[name]) for name in selected())
+
+
+def report() -> dict:
+    """
+    获取预热状态
+
+    Returns:
+        是否全部就绪以及各子系统的状态
+    """
+    return {"ready": ready(), "subsystems": {name: status.get(name, {"ready": False}) for name in selected()}}
+
+
+def cache_dir() -> Optional[Path]:
+    """
+    获取编译产物缓存目录，优先使用环境变量 `WARMUP_CACHE`，其次为 NAS 挂载目录
+
+    Returns:
+        缓存目录，均不可用时返回空
+    """
+    if "WARMUP_CACHE" in os.environ:
+        path = Path(os.environ["WARMUP_CACHE"])
+    else:
+        nas = Path("/mnt/serverless-nana7mi-link")
+        if not nas.is_dir():
+            return None
+        path = nas / "cache"
+    try:
+        path.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+    return path